@@ -1,18 +1,33 @@
 # backend/app.py - Cleaned + Fixed GenieSugar Backend (Option A)
 from flask import Flask, request, jsonify
+from celery import Celery, Task
+from kombu.exceptions import OperationalError as BrokerError
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
 from flask_jwt_extended import (
-    JWTManager, create_access_token, jwt_required, get_jwt_identity
+    JWTManager, create_access_token, jwt_required, get_jwt_identity, get_jwt
 )
-from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.security import check_password_hash
+from argon2 import PasswordHasher
+from argon2.exceptions import VerificationError, InvalidHashError
 from datetime import datetime, timedelta, timezone
+from typing import Optional
 from dotenv import load_dotenv
-from dateutil import parser as dtparser
+from sqlalchemy import func, and_, insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import validates
 import os
+import urllib.error
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import redis
+from python_http_client.exceptions import HTTPError as SendGridHTTPError
+import msgspec
+import numpy as np
 import json
 import html
+import threading
 
 load_dotenv()
 
@@ -28,10 +43,36 @@ if not DATABASE_URL:
 JWT_SECRET = os.getenv("JWT_SECRET_KEY", "change-me-in-env")
 OPENAI_KEY = os.getenv("OPENAI_API_KEY")
 OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")  # change if you want
+REDIS_URL = os.getenv("REDIS_URL")
+# If the revocation denylist can't be checked, reject tokens unless explicitly opted out
+JWT_REVOCATION_FAIL_OPEN = os.getenv("JWT_REVOCATION_FAIL_OPEN", "false").lower() == "true"
+
+# Reuse pooled connections; pre-ping drops ones the server has closed.
+# Pool is per gunicorn worker process: peak DB connections per instance =
+# workers x (pool_size + max_overflow) = 4 x (5 + 5) = 40 with gunicorn.conf.py
+# defaults (8 threads/worker fit in 10), plus Celery workers. Keep that under the
+# server's limit (Postgres max_connections=100 by default; small Azure SQL tiers lower).
+# Memory: Argon2 needs 64 MiB per concurrent hash; capped at ARGON2_MAX_CONCURRENT
+# per worker (default 2 -> 4 x 2 x 64 MiB = 512 MiB peak), see hash_password().
+ENGINE_OPTIONS = {"pool_pre_ping": True, "pool_recycle": 1800}
+if not DATABASE_URL.startswith("sqlite"):
+    ENGINE_OPTIONS.update(
+        pool_size=int(os.getenv("DB_POOL_SIZE", "5")),
+        max_overflow=int(os.getenv("DB_MAX_OVERFLOW", "5")),
+    )
+if DATABASE_URL.startswith("mssql+pyodbc"):
+    # Send executemany() batches in one round trip instead of one per row
+    ENGINE_OPTIONS["fast_executemany"] = True
+if DATABASE_URL.startswith("postgres"):
+    ENGINE_OPTIONS["connect_args"] = {
+        "application_name": "geniesugar",
+        "options": "-c statement_timeout=5000",
+    }
 
 app.config.update(
     SQLALCHEMY_DATABASE_URI=DATABASE_URL,
     SQLALCHEMY_TRACK_MODIFICATIONS=False,
+    SQLALCHEMY_ENGINE_OPTIONS=ENGINE_OPTIONS,
     JWT_SECRET_KEY=JWT_SECRET,
     JWT_ACCESS_TOKEN_EXPIRES=timedelta(days=7),
 )
@@ -39,6 +80,38 @@ app.config.update(
 db = SQLAlchemy(app)
 jwt = JWTManager(app)
 
+# -------------------- TASK QUEUE --------------------
+class FlaskTask(Task):
+    """Run every Celery task inside the Flask app context (DB session, config)."""
+    def __call__(self, *args, **kwargs):
+        with app.app_context():
+            return self.run(*args, **kwargs)
+
+celery = Celery("geniesugar", broker=REDIS_URL, backend=REDIS_URL, task_cls=FlaskTask)
+celery.conf.update(
+    # Without a broker (local dev) tasks run inline so .delay() still works
+    task_always_eager=not REDIS_URL,
+    task_acks_late=True,
+    worker_prefetch_multiplier=1,
+    result_expires=3600,
+)
+
+def enqueue(task, *args):
+    """Queue a fire-and-forget task; a broker outage must not fail the request."""
+    try:
+        return task.delay(*args)
+    except (BrokerError, redis.RedisError) as e:
+        print(f"Queue error ({task.name}): {e}")
+        return None
+
+# -------------------- CACHE --------------------
+# Optional: without REDIS_URL every read goes straight to the database
+redis_client = redis.Redis.from_url(REDIS_URL) if REDIS_URL else None
+
+GLUCOSE_CACHE_TTL = 60
+FOOD_LOGS_CACHE_TTL = 60
+DOCTOR_PATIENTS_CACHE_TTL = 300
+
 # -------------------- MODELS --------------------
 class User(db.Model):
     __tablename__ = "users"
@@ -55,26 +128,36 @@ class User(db.Model):
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
 
     glucose_readings = db.relationship(
-        "GlucoseReading", backref="user", lazy=True, cascade="all, delete-orphan"
+        "GlucoseReading", backref="user", lazy="select", cascade="all, delete-orphan"
     )
     food_logs = db.relationship(
-        "FoodLog", backref="user", lazy=True, cascade="all, delete-orphan"
+        "FoodLog", backref="user", lazy="select", cascade="all, delete-orphan"
     )
 
+    @validates("email")
+    def normalize_email(self, key, value):
+        # Always stored lowercased so lookups hit the plain unique index
+        return value.lower().strip() if value else value
+
 class GlucoseReading(db.Model):
     __tablename__ = "glucose_readings"
     reading_id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey("users.user_id"), nullable=False, index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("users.user_id"), nullable=False)
     reading_value = db.Column(db.Float, nullable=False)
     timestamp = db.Column(db.DateTime, nullable=False, default=lambda: datetime.now(timezone.utc), index=True)
     context = db.Column(db.String(50))
     notes = db.Column(db.Text)
     is_synced = db.Column(db.Boolean, default=False)
 
+    # Backs "user's readings since X, newest first" and keeps Dexcom syncs duplicate-free
+    __table_args__ = (
+        db.Index("ix_glucose_user_ts", user_id, timestamp.desc(), unique=True),
+    )
+
 class FoodLog(db.Model):
     __tablename__ = "food_logs"
     log_id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey("users.user_id"), nullable=False, index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("users.user_id"), nullable=False)
     food_name = db.Column(db.String(200), nullable=False)
     quantity = db.Column(db.String(50))
     calories = db.Column(db.Integer)
@@ -83,6 +166,10 @@ class FoodLog(db.Model):
     meal_type = db.Column(db.String(20))
     timestamp = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), index=True)
 
+    __table_args__ = (
+        db.Index("ix_food_user_ts", user_id, timestamp.desc()),
+    )
+
 class Appointment(db.Model):
     __tablename__ = "appointments"
     appointment_id = db.Column(db.Integer, primary_key=True)
@@ -101,7 +188,59 @@ class Comment(db.Model):
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
 
 
+# -------------------- RESPONSE SCHEMAS --------------------
+# msgspec Structs: encoded straight to JSON bytes (datetimes included) without per-row dicts
+class GlucoseReadingOut(msgspec.Struct):
+    id: int
+    value: float
+    timestamp: datetime
+    context: Optional[str]
+    notes: Optional[str]
+    synced: Optional[bool]
+
+class FoodLogOut(msgspec.Struct):
+    id: int
+    food_name: str
+    quantity: Optional[str]
+    calories: Optional[int]
+    carbs: Optional[float]
+    protein: Optional[float]
+    meal_type: Optional[str]
+    timestamp: Optional[datetime]
+
+class PatientSummaryOut(msgspec.Struct):
+    id: int
+    name: str
+    email: str
+    phone: Optional[str]
+    last_reading: Optional[float]
+    avg_glucose: Optional[float]
+    readings_count: int
+
+json_encoder = msgspec.json.Encoder()
+
+
 # -------------------- HELPERS --------------------
+# Shared keep-alive session so Dexcom syncs reuse TCP/TLS connections
+_dexcom_session = requests.Session()
+_dexcom_session.mount("https://", HTTPAdapter(
+    pool_connections=10,
+    pool_maxsize=20,
+    max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[502, 503, 504]),
+))
+
+# One OpenAI client per process so chat requests share its connection pool
+_openai_client = None
+if OPENAI_KEY:
+    from openai import OpenAI
+    _openai_client = OpenAI(api_key=OPENAI_KEY)
+
+_SYSTEM_PROMPT_BASE = (
+    "You are a helpful diabetes management assistant. "
+    "Provide accurate, supportive advice about diabetes care, nutrition, exercise, and medication. "
+    "Always remind users to consult their healthcare provider for medical decisions."
+)
+
 def api_error(message, code=400):
     return jsonify({"success": False, "error": message}), code
 
@@ -112,6 +251,83 @@ def require_json(*fields):
         return None, api_error(f"Missing fields: {', '.join(missing)}", 400)
     return data, None
 
+# Argon2id (C implementation); Werkzeug is kept only to verify legacy PBKDF2 hashes
+ph = PasswordHasher(time_cost=2, memory_cost=65536, parallelism=2)
+
+# Each hash/verify allocates 64 MiB. Without a cap, 4 workers x 8 threads could
+# need 32 x 64 MiB = 2 GiB during a login burst; with ARGON2_MAX_CONCURRENT=2 per
+# worker the peak is 4 x 2 x 64 MiB = 512 MiB. Size it to the App Service plan.
+_argon2_slots = threading.BoundedSemaphore(int(os.getenv("ARGON2_MAX_CONCURRENT", "2")))
+
+def hash_password(password):
+    with _argon2_slots:
+        return ph.hash(password)
+
+def verify_password(user, password):
+    """Check a password, upgrading legacy/outdated hashes to current Argon2 params."""
+    if user.password_hash.startswith("$argon2"):
+        try:
+            with _argon2_slots:
+                ph.verify(user.password_hash, password)
+        except (VerificationError, InvalidHashError):
+            return False
+        if not ph.check_needs_rehash(user.password_hash):
+            return True
+    elif not check_password_hash(user.password_hash, password):
+        return False
+
+    user.password_hash = hash_password(password)
+    db.session.commit()
+    return True
+
+def cache_get(key):
+    """Return cached bytes for key, or None on miss / no Redis."""
+    if not redis_client:
+        return None
+    try:
+        return redis_client.get(key)
+    except redis.RedisError as e:
+        print(f"Cache error: {e}")
+        return None
+
+def cache_set(key, value, ttl, group=None):
+    """Cache value for ttl seconds; group tracks keys to invalidate together."""
+    if not redis_client:
+        return
+    try:
+        pipe = redis_client.pipeline()
+        pipe.setex(key, ttl, value)
+        if group:
+            pipe.sadd(group, key)
+            pipe.expire(group, ttl)
+        pipe.execute()
+    except redis.RedisError as e:
+        print(f"Cache error: {e}")
+
+def cache_delete(key):
+    if not redis_client:
+        return
+    try:
+        redis_client.delete(key)
+    except redis.RedisError as e:
+        print(f"Cache error: {e}")
+
+def cache_invalidate(group):
+    """Drop every key recorded under group, plus the group itself."""
+    if not redis_client:
+        return
+    try:
+        keys = redis_client.smembers(group)
+        redis_client.delete(group, *keys)
+    except redis.RedisError as e:
+        print(f"Cache error: {e}")
+
+def json_response(body):
+    """Wrap already-encoded JSON bytes (cache hit or msgspec output) in a response."""
+    return app.response_class(body, mimetype="application/json")
+
+@celery.task(autoretry_for=(urllib.error.URLError, SendGridHTTPError), max_retries=3,
+             retry_backoff=True, ignore_result=True)
 def send_email(to_email, subject, html_content):
     """Send email via SendGrid (safe if keys missing)."""
     try:
@@ -132,10 +348,54 @@ def send_email(to_email, subject, html_content):
         )
         response = sg.send(message)
         return response.status_code == 202
+    except (urllib.error.URLError, SendGridHTTPError):
+        raise
+    except Exception as e:
+        print(f"Email error: {e}")
+        return False
+
+@celery.task(autoretry_for=(urllib.error.URLError, SendGridHTTPError), max_retries=3,
+             retry_backoff=True, ignore_result=True)
+def send_email_bulk(messages):
+    """
+    Send several emails in a single SendGrid request (safe if keys missing).
+    messages: [{"to": ..., "subject": ..., "html": ...}], one personalization each.
+    """
+    if not messages:
+        return True
+
+    try:
+        import sendgrid
+        from sendgrid.helpers.mail import Mail, Personalization, To, Substitution
+
+        key = os.getenv("SENDGRID_API_KEY")
+        if not key:
+            print("SendGrid key missing; skipping email.")
+            return False
+
+        sg = sendgrid.SendGridAPIClient(api_key=key)
+        message = Mail(
+            from_email=os.getenv("SENDGRID_FROM_EMAIL", "noreply@geniesugar.com"),
+            subject="GenieSugar",
+            html_content="-body-",
+        )
+        for m in messages:
+            personalization = Personalization()
+            personalization.add_to(To(m["to"]))
+            personalization.subject = m["subject"]
+            personalization.add_substitution(Substitution("-body-", m["html"]))
+            message.add_personalization(personalization)
+
+        response = sg.send(message)
+        return response.status_code == 202
+    except (urllib.error.URLError, SendGridHTTPError):
+        raise
     except Exception as e:
         print(f"Email error: {e}")
         return False
 
+@celery.task(autoretry_for=(requests.RequestException,), max_retries=3, retry_backoff=True,
+             ignore_result=True)
 def send_sms(to_phone, message):
     """Send SMS via Twilio (safe if keys missing)."""
     try:
@@ -150,10 +410,36 @@ def send_sms(to_phone, message):
         client = Client(sid, token)
         client.messages.create(body=message, from_=from_num, to=to_phone)
         return True
+    except requests.RequestException:
+        raise
     except Exception as e:
         print(f"SMS error: {e}")
         return False
 
+def insert_new_readings(user_id, incoming):
+    """
+    Insert the readings in incoming (naive UTC timestamp -> row) not already stored.
+    One query for what's stored in the window, one executemany insert for the rest.
+    """
+    existing = {
+        t.replace(tzinfo=None) for (t,) in db.session.query(GlucoseReading.timestamp).filter(
+            GlucoseReading.user_id == user_id,
+            GlucoseReading.timestamp >= min(incoming),
+            GlucoseReading.timestamp <= max(incoming),
+        )
+    }
+    rows = [row for key, row in incoming.items() if key not in existing]
+    if rows:
+        db.session.execute(insert(GlucoseReading), rows)
+    return rows
+
+def is_reading_collision(err):
+    """True if an IntegrityError came from ix_glucose_user_ts (same user + timestamp)."""
+    msg = str(err.orig)
+    # SQL Server / Postgres name the index; SQLite names the columns
+    return "ix_glucose_user_ts" in msg or "UNIQUE constraint failed: glucose_readings." in msg
+
+@celery.task
 def sync_dexcom_data(user_id):
     """
     Sync glucose data from Dexcom v3 /egvs.
@@ -182,63 +468,105 @@ def sync_dexcom_data(user_id):
         url = f"{base_url}/v3/users/self/egvs"
         params = {"startDate": start_date, "endDate": end_date}
 
-        response = requests.get(url, headers=headers, params=params, timeout=20)
+        response = _dexcom_session.get(url, headers=headers, params=params, timeout=20)
 
         if response.status_code != 200:
             return {"success": False, "error": f"Dexcom API error: {response.status_code}"}
 
         data = response.json()
-        readings_added = 0
 
+        # Keyed by naive UTC timestamp (how the DB hands it back); also drops duplicates
+        incoming = {}
         for reading in data.get("egvs", []):
             system_time = reading.get("systemTime")
-            if not system_time:
+            if not system_time or reading.get("value") is None:
                 continue
 
-            ts = dtparser.isoparse(system_time).astimezone(timezone.utc)
+            # systemTime is UTC (fixed ISO format, usually without offset); C-level parse
+            ts = datetime.fromisoformat(system_time)
+            ts = ts.replace(tzinfo=timezone.utc) if ts.tzinfo is None else ts.astimezone(timezone.utc)
+            incoming[ts.replace(tzinfo=None)] = {
+                "user_id": user_id,
+                "reading_value": reading.get("value"),
+                "timestamp": ts,
+                "is_synced": True,
+            }
 
-            existing = GlucoseReading.query.filter_by(
-                user_id=user_id,
-                timestamp=ts
-            ).first()
-
-            if not existing:
-                new_reading = GlucoseReading(
-                    user_id=user_id,
-                    reading_value=reading.get("value"),
-                    timestamp=ts,
-                    is_synced=True
-                )
-                db.session.add(new_reading)
-                readings_added += 1
+        rows = []
+        if incoming:
+            try:
+                rows = insert_new_readings(user_id, incoming)
+                db.session.commit()
+            except IntegrityError as e:
+                db.session.rollback()
+                if not is_reading_collision(e):
+                    raise
+                # A concurrent sync inserted some of these first; diff again once.
+                # A second failure propagates and is reported as an error below.
+                rows = insert_new_readings(user_id, incoming)
+                db.session.commit()
+
+        readings_added = len(rows)
+        if readings_added:
+            cache_invalidate(f"glucose:{user_id}:keys")
+
+        # 24h summary over everything Dexcom returned, vectorized
+        window = np.fromiter(
+            (row["reading_value"] for row in incoming.values()),
+            dtype=np.float32,
+        )
+        stats = None
+        if window.size:
+            stats = {
+                "avg_glucose": round(float(window.mean()), 1),
+                "time_in_range": round(float(((window >= 70) & (window <= 180)).mean()) * 100, 1),
+                "low_count": int((window < 70).sum()),
+                "high_count": int((window > 200).sum()),
+            }
 
-        db.session.commit()
-        return {"success": True, "readings_added": readings_added}
+        # One alert per kind for the newly added readings, emailed in a single SendGrid call
+        added = np.fromiter(
+            (row["reading_value"] for row in rows),
+            dtype=np.float32,
+        )
+        lows = added[added < 70]
+        highs = added[added > 200]
+        alerts = []
+        if lows.size:
+            alerts.append(("Critical Low Glucose Alert",
+                f"⚠️ LOW GLUCOSE ALERT: {lows.size} reading(s) below 70 mg/dL, lowest {lows.min():g} mg/dL "
+                "- Take fast-acting carbs and recheck soon."))
+        if highs.size:
+            alerts.append(("Critical High Glucose Alert",
+                f"⚠️ HIGH GLUCOSE ALERT: {highs.size} reading(s) above 200 mg/dL, highest {highs.max():g} mg/dL "
+                "- Monitor closely and contact your doctor if persistent."))
+        if alerts:
+            enqueue(send_email_bulk, [
+                {"to": user.email, "subject": subject, "html": f"<h2>{html.escape(alert_msg)}</h2>"}
+                for subject, alert_msg in alerts
+            ])
+            if user.phone:
+                enqueue(send_sms, user.phone, "\n".join(alert_msg for _, alert_msg in alerts))
+
+        return {"success": True, "readings_added": readings_added, "stats": stats}
     except Exception as e:
         db.session.rollback()
         return {"success": False, "error": str(e)}
 
+@celery.task
 def get_ai_response(message, user_context=None):
     """
     OpenAI response using current Python SDK client style. :contentReference[oaicite:3]{index=3}
     """
-    if not OPENAI_KEY:
+    if not _openai_client:
         return {"success": False, "response": "OpenAI API key not configured."}
 
     try:
-        from openai import OpenAI
-        client = OpenAI(api_key=OPENAI_KEY)
-
-        system_prompt = (
-            "You are a helpful diabetes management assistant. "
-            "Provide accurate, supportive advice about diabetes care, nutrition, exercise, and medication. "
-            "Always remind users to consult their healthcare provider for medical decisions."
-        )
-
+        system_prompt = _SYSTEM_PROMPT_BASE
         if user_context:
-            system_prompt += f"\nUser context: {json.dumps(user_context)}"
+            system_prompt = f"{_SYSTEM_PROMPT_BASE}\nUser context: {json.dumps(user_context)}"
 
-        resp = client.chat.completions.create(
+        resp = _openai_client.chat.completions.create(
             model=OPENAI_MODEL,
             messages=[
                 {"role": "system", "content": system_prompt},
@@ -256,40 +584,9 @@ def get_ai_response(message, user_context=None):
         }
 
 
-# -------------------- HEALTH --------------------
-@app.route("/api/health", methods=["GET"])
-def health():
-    return jsonify({"success": True, "status": "ok", "time": datetime.now(timezone.utc).isoformat()})
-
-
-# -------------------- AUTH --------------------
-@app.route("/api/auth/register", methods=["POST"])
-def register():
-    data, err = require_json("full_name", "email", "password")
-    if err:
-        return err
-
-    try:
-        if User.query.filter_by(email=data["email"]).first():
-            return api_error("Email already registered", 400)
-
-        dob = None
-        if data.get("date_of_birth"):
-            dob = datetime.strptime(data["date_of_birth"], "%Y-%m-%d").date()
-
-        user = User(
-            full_name=data["full_name"],
-            email=data["email"].lower().strip(),
-            phone=data.get("phone"),
-            password_hash=generate_password_hash(data["password"]),
-            role=data.get("role", "patient"),
-            date_of_birth=dob,
-        )
-        db.session.add(user)
-        db.session.commit()
-
-        # Send welcome email
-        welcome_email_html = f"""
+# -------------------- EMAIL TEMPLATES --------------------
+# Only the recipient name varies; formatted per signup with the escaped name
+_WELCOME_EMAIL_HTML = """
         <!DOCTYPE html>
         <html>
         <head>
@@ -312,7 +609,7 @@ def register():
                             <tr>
                                 <td style="padding: 40px 30px;">
                                     <h2 style="color: #1e3a8a; margin: 0 0 20px 0; font-size: 24px;">
-                                        Hi {html.escape(user.full_name)}! 👋
+                                        Hi {name}! 👋
                                     </h2>
                                     
                                     <p style="color: #333333; font-size: 16px; line-height: 1.6; margin: 0 0 20px 0;">
@@ -383,15 +680,52 @@ def register():
         </body>
         </html>
         """
+
+
+# -------------------- HEALTH --------------------
+@app.route("/api/health", methods=["GET"])
+def health():
+    return jsonify({"success": True, "status": "ok", "time": datetime.now(timezone.utc).isoformat()})
+
+
+# -------------------- AUTH --------------------
+@app.route("/api/auth/register", methods=["POST"])
+def register():
+    data, err = require_json("full_name", "email", "password")
+    if err:
+        return err
+
+    try:
+        if User.query.filter_by(email=data["email"].lower().strip()).first():
+            return api_error("Email already registered", 400)
+
+        dob = None
+        if data.get("date_of_birth"):
+            dob = datetime.strptime(data["date_of_birth"], "%Y-%m-%d").date()
+
+        user = User(
+            full_name=data["full_name"],
+            email=data["email"],
+            phone=data.get("phone"),
+            password_hash=hash_password(data["password"]),
+            role=data.get("role", "patient"),
+            date_of_birth=dob,
+        )
+        db.session.add(user)
+        db.session.commit()
+
+        # Send welcome email
+        welcome_email_html = _WELCOME_EMAIL_HTML.format(name=html.escape(user.full_name))
         
-        send_email(
+        enqueue(
+            send_email,
             user.email,
             "Welcome to GenieSugar! 🎉",
             welcome_email_html
         )
 
         if user.phone:
-            send_sms(user.phone, f"Welcome to GenieSugar, {user.full_name}! Your account is ready.")
+            enqueue(send_sms, user.phone, f"Welcome to GenieSugar, {user.full_name}! Your account is ready.")
 
         return jsonify({
             "success": True, 
@@ -417,12 +751,13 @@ def login():
 
     try:
         user = User.query.filter_by(email=data["email"].lower().strip()).first()
-        if not user or not check_password_hash(user.password_hash, data["password"]):
+        if not user or not verify_password(user, data["password"]):
             return api_error("Invalid credentials", 401)
 
         token = create_access_token(identity=user.user_id)
 
-        send_email(
+        enqueue(
+            send_email,
             user.email,
             "New Login to Your GenieSugar Account",
             f"Hi {html.escape(user.full_name)}, you just logged in to GenieSugar. If this wasn't you, secure your account.",
@@ -441,6 +776,34 @@ def login():
     except Exception as e:
         return api_error(str(e), 500)
 
+@jwt.token_in_blocklist_loader
+def is_token_revoked(jwt_header, jwt_payload):
+    """O(1) Redis lookup per request; entries expire with the token itself."""
+    if not redis_client:
+        # Revocation not configured
+        return False
+    try:
+        return redis_client.exists(f"auth:revoked:{jwt_payload['jti']}") == 1
+    except redis.RedisError as e:
+        # Can't prove the token wasn't revoked: reject it (fail closed) by default
+        print(f"Token blocklist error: {e}")
+        return not JWT_REVOCATION_FAIL_OPEN
+
+@app.route("/api/auth/logout", methods=["POST"])
+@jwt_required()
+def logout():
+    if not redis_client:
+        return api_error("Token revocation not configured", 503)
+
+    try:
+        payload = get_jwt()
+        ttl = int(payload["exp"] - datetime.now(timezone.utc).timestamp())
+        if ttl > 0:
+            redis_client.setex(f"auth:revoked:{payload['jti']}", ttl, "1")
+        return jsonify({"success": True, "message": "Logged out"}), 200
+    except redis.RedisError as e:
+        return api_error(str(e), 503)
+
 
 # -------------------- GLUCOSE --------------------
 @app.route("/api/glucose", methods=["GET"])
@@ -449,6 +812,12 @@ def get_glucose_readings():
     try:
         user_id = get_jwt_identity()
         days = request.args.get("days", 7, type=int)
+
+        cache_key = f"glucose:{user_id}:{days}"
+        cached = cache_get(cache_key)
+        if cached:
+            return json_response(cached), 200
+
         start_date = datetime.now(timezone.utc) - timedelta(days=days)
 
         readings = (GlucoseReading.query
@@ -457,17 +826,19 @@ def get_glucose_readings():
             .all()
         )
 
-        return jsonify({
+        body = json_encoder.encode({
             "success": True,
-            "readings": [{
-                "id": r.reading_id,
-                "value": round(r.reading_value, 1),
-                "timestamp": r.timestamp.isoformat(),
-                "context": r.context,
-                "notes": r.notes,
-                "synced": r.is_synced
-            } for r in readings]
-        }), 200
+            "readings": [GlucoseReadingOut(
+                id=r.reading_id,
+                value=round(r.reading_value, 1),
+                timestamp=r.timestamp,
+                context=r.context,
+                notes=r.notes,
+                synced=r.is_synced,
+            ) for r in readings]
+        })
+        cache_set(cache_key, body, GLUCOSE_CACHE_TTL, group=f"glucose:{user_id}:keys")
+        return json_response(body), 200
 
     except Exception as e:
         return api_error(str(e), 500)
@@ -481,33 +852,35 @@ def add_glucose_reading():
 
     try:
         user_id = get_jwt_identity()
+        val = float(data["reading_value"])
 
-        reading = GlucoseReading(
-            user_id=user_id,
-            reading_value=float(data["reading_value"]),
-            context=data.get("context"),
-            notes=data.get("notes"),
-            timestamp=datetime.now(timezone.utc)
-        )
-        db.session.add(reading)
+        # Core insert: no ORM object/unit-of-work tracking for a write-only path
+        reading_id = db.session.execute(
+            insert(GlucoseReading).values(
+                user_id=user_id,
+                reading_value=val,
+                context=data.get("context"),
+                notes=data.get("notes"),
+                timestamp=datetime.now(timezone.utc)
+            ).returning(GlucoseReading.reading_id)
+        ).scalar_one()
         db.session.commit()
-
-        user = User.query.get(user_id)
-        val = reading.reading_value
-
-        if val < 70:
-            alert_msg = f"⚠️ LOW GLUCOSE ALERT: {val} mg/dL - Take fast-acting carbs and recheck soon."
-            send_email(user.email, "Critical Low Glucose Alert", f"<h2>{html.escape(alert_msg)}</h2>")
-            if user.phone:
-                send_sms(user.phone, alert_msg)
-
-        elif val > 200:
-            alert_msg = f"⚠️ HIGH GLUCOSE ALERT: {val} mg/dL - Monitor closely and contact your doctor if persistent."
-            send_email(user.email, "Critical High Glucose Alert", f"<h2>{html.escape(alert_msg)}</h2>")
+        cache_invalidate(f"glucose:{user_id}:keys")
+
+        if val < 70 or val > 200:
+            if val < 70:
+                subject = "Critical Low Glucose Alert"
+                alert_msg = f"⚠️ LOW GLUCOSE ALERT: {val} mg/dL - Take fast-acting carbs and recheck soon."
+            else:
+                subject = "Critical High Glucose Alert"
+                alert_msg = f"⚠️ HIGH GLUCOSE ALERT: {val} mg/dL - Monitor closely and contact your doctor if persistent."
+
+            user = db.session.query(User.email, User.phone).filter(User.user_id == user_id).one()
+            enqueue(send_email, user.email, subject, f"<h2>{html.escape(alert_msg)}</h2>")
             if user.phone:
-                send_sms(user.phone, alert_msg)
+                enqueue(send_sms, user.phone, alert_msg)
 
-        return jsonify({"success": True, "reading_id": reading.reading_id}), 201
+        return jsonify({"success": True, "reading_id": reading_id}), 201
 
     except Exception as e:
         db.session.rollback()
@@ -517,6 +890,7 @@ def add_glucose_reading():
 @jwt_required()
 def sync_dexcom():
     user_id = get_jwt_identity()
+    # Run inline: the dashboard shows readings_added right away
     result = sync_dexcom_data(user_id)
     return jsonify(result), 200 if result.get("success") else 400
 
@@ -527,35 +901,60 @@ def sync_dexcom():
 def get_doctor_patients():
     try:
         # In a real app you'd check role == doctor here
-        patients = User.query.filter_by(role="patient").all()
+        cached = cache_get("doctor:patients")
+        if cached:
+            return json_response(cached), 200
 
-        patient_list = []
         seven_days_ago = datetime.now(timezone.utc) - timedelta(days=7)
 
-        for patient in patients:
-            readings = GlucoseReading.query.filter(
-                GlucoseReading.user_id == patient.user_id,
-                GlucoseReading.timestamp >= seven_days_ago
-            ).all()
-
-            avg_glucose = None
-            last_reading = None
-            if readings:
-                values = [r.reading_value for r in readings]
-                avg_glucose = sum(values) / len(values)
-                last_reading = readings[-1].reading_value
-
-            patient_list.append({
-                "id": patient.user_id,
-                "name": patient.full_name,
-                "email": patient.email,
-                "phone": patient.phone,
-                "last_reading": round(last_reading, 1) if last_reading else None,
-                "avg_glucose": round(avg_glucose, 1) if avg_glucose else None,
-                "readings_count": len(readings),
-            })
-
-        return jsonify({"success": True, "patients": patient_list}), 200
+        # One grouped query for per-patient stats instead of a query per patient
+        stats = (db.session.query(
+                User.user_id, User.full_name, User.email, User.phone,
+                func.avg(GlucoseReading.reading_value),
+                func.count(GlucoseReading.reading_id),
+            )
+            .outerjoin(GlucoseReading, and_(
+                GlucoseReading.user_id == User.user_id,
+                GlucoseReading.timestamp >= seven_days_ago,
+            ))
+            .filter(User.role == "patient")
+            .group_by(User.user_id, User.full_name, User.email, User.phone)
+            .all()
+        )
+
+        # Most recent reading in the window for every patient, in a single query
+        latest = (db.session.query(
+                GlucoseReading.user_id,
+                func.max(GlucoseReading.timestamp).label("timestamp"),
+            )
+            .filter(GlucoseReading.timestamp >= seven_days_ago)
+            .group_by(GlucoseReading.user_id)
+            .subquery()
+        )
+        last_values = dict(db.session.query(GlucoseReading.user_id, GlucoseReading.reading_value)
+            .join(latest, and_(
+                GlucoseReading.user_id == latest.c.user_id,
+                GlucoseReading.timestamp == latest.c.timestamp,
+            ))
+            .all()
+        )
+
+        patient_list = []
+        for user_id, full_name, email, phone, avg_glucose, readings_count in stats:
+            last_reading = last_values.get(user_id)
+            patient_list.append(PatientSummaryOut(
+                id=user_id,
+                name=full_name,
+                email=email,
+                phone=phone,
+                last_reading=round(last_reading, 1) if last_reading else None,
+                avg_glucose=round(avg_glucose, 1) if avg_glucose else None,
+                readings_count=readings_count,
+            ))
+
+        body = json_encoder.encode({"success": True, "patients": patient_list})
+        cache_set("doctor:patients", body, DOCTOR_PATIENTS_CACHE_TTL)
+        return json_response(body), 200
 
     except Exception as e:
         return api_error(str(e), 500)
@@ -579,10 +978,12 @@ def add_doctor_comment(patient_id):
         db.session.add(comment)
         db.session.commit()
 
-        patient = User.query.get(patient_id)
-        doctor = User.query.get(doctor_id)
+        users = {u.user_id: u for u in User.query.filter(User.user_id.in_([patient_id, doctor_id]))}
+        patient = users[patient_id]
+        doctor = users[doctor_id]
 
-        send_email(
+        enqueue(
+            send_email,
             patient.email,
             "New Message from Your Doctor",
             f"""
@@ -611,25 +1012,45 @@ def ai_chat():
 
     try:
         user_id = get_jwt_identity()
-        user = User.query.get(user_id)
 
-        recent_readings = (GlucoseReading.query
-            .filter_by(user_id=user_id)
+        # User name + last 5 readings in one round trip
+        rows = (db.session.query(User.full_name, GlucoseReading.reading_value)
+            .outerjoin(GlucoseReading, GlucoseReading.user_id == User.user_id)
+            .filter(User.user_id == user_id)
             .order_by(GlucoseReading.timestamp.desc())
             .limit(5).all()
         )
 
         context = {
-            "user_name": user.full_name,
-            "recent_glucose": [r.reading_value for r in recent_readings],
+            "user_name": rows[0].full_name,
+            "recent_glucose": [r.reading_value for r in rows if r.reading_value is not None],
         }
 
-        result = get_ai_response(data["message"], context)
-        return jsonify(result), 200
+        task = get_ai_response.delay(data["message"], context)
+        if task.ready():
+            return jsonify(task.result), 200
+
+        # Only the requesting user may poll for this reply
+        cache_set(f"ai:task:{task.id}", str(user_id), 3600)
+        return jsonify({"success": True, "pending": True, "task_id": task.id}), 202
 
     except Exception:
         return jsonify({"success": False, "response": "Error processing request"}), 500
 
+@app.route("/api/ai/chat/<task_id>", methods=["GET"])
+@jwt_required()
+def ai_chat_result(task_id):
+    owner = cache_get(f"ai:task:{task_id}")
+    if owner is None or owner.decode() != str(get_jwt_identity()):
+        return api_error("Unknown or expired task", 404)
+
+    task = get_ai_response.AsyncResult(task_id)
+    if not task.ready():
+        return jsonify({"success": True, "pending": True, "task_id": task_id}), 202
+    if task.failed():
+        return jsonify({"success": False, "response": "Error processing request"}), 500
+    return jsonify(task.result), 200
+
 
 # -------------------- FOOD LOGS --------------------
 @app.route("/api/food-logs", methods=["GET", "POST"])
@@ -638,25 +1059,32 @@ def food_logs():
     user_id = get_jwt_identity()
 
     if request.method == "GET":
+        cache_key = f"food_logs:{user_id}"
+        cached = cache_get(cache_key)
+        if cached:
+            return json_response(cached), 200
+
         logs = (FoodLog.query
             .filter_by(user_id=user_id)
             .order_by(FoodLog.timestamp.desc())
             .limit(50).all()
         )
 
-        return jsonify({
+        body = json_encoder.encode({
             "success": True,
-            "logs": [{
-                "id": log.log_id,
-                "food_name": log.food_name,
-                "quantity": log.quantity,
-                "calories": log.calories,
-                "carbs": log.carbs,
-                "protein": log.protein,
-                "meal_type": log.meal_type,
-                "timestamp": log.timestamp.isoformat(),
-            } for log in logs]
-        }), 200
+            "logs": [FoodLogOut(
+                id=log.log_id,
+                food_name=log.food_name,
+                quantity=log.quantity,
+                calories=log.calories,
+                carbs=log.carbs,
+                protein=log.protein,
+                meal_type=log.meal_type,
+                timestamp=log.timestamp,
+            ) for log in logs]
+        })
+        cache_set(cache_key, body, FOOD_LOGS_CACHE_TTL)
+        return json_response(body), 200
 
     # POST
     data, err = require_json("food_name")
@@ -664,20 +1092,22 @@ def food_logs():
         return err
 
     try:
-        log = FoodLog(
-            user_id=user_id,
-            food_name=data["food_name"],
-            quantity=data.get("quantity"),
-            calories=data.get("calories"),
-            carbs=data.get("carbs"),
-            protein=data.get("protein"),
-            meal_type=data.get("meal_type"),
-            timestamp=datetime.now(timezone.utc),
-        )
-        db.session.add(log)
+        log_id = db.session.execute(
+            insert(FoodLog).values(
+                user_id=user_id,
+                food_name=data["food_name"],
+                quantity=data.get("quantity"),
+                calories=data.get("calories"),
+                carbs=data.get("carbs"),
+                protein=data.get("protein"),
+                meal_type=data.get("meal_type"),
+                timestamp=datetime.now(timezone.utc),
+            ).returning(FoodLog.log_id)
+        ).scalar_one()
         db.session.commit()
+        cache_delete(f"food_logs:{user_id}")
 
-        return jsonify({"success": True, "log_id": log.log_id}), 201
+        return jsonify({"success": True, "log_id": log_id}), 201
 
     except Exception as e:
         db.session.rollback()
@@ -685,8 +1115,15 @@ def food_logs():
 
 
 # -------------------- INIT DB --------------------
+# Run once per deploy (`flask --app app init-db`), not on every worker start
+@app.cli.command("init-db")
+def init_db():
+    """Create all tables and indexes."""
+    db.create_all()
+    print("Database tables created.")
 
 
+# Local development only; production runs `gunicorn app:app` (see gunicorn.conf.py)
 if __name__ == "__main__":
     debug_mode = os.getenv("FLASK_ENV", "").lower() != "production"
     app.run(debug=debug_mode, host="0.0.0.0", port=8000)
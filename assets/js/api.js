@@ -88,7 +88,16 @@ class GenieSugarAPI {
         return data;
     }
 
-    logout() {
+    async logout() {
+        // Best-effort server-side revocation; always clear local state afterwards
+        if (this.getToken()) {
+            try {
+                await this.request('/auth/logout', { method: 'POST' });
+            } catch (error) {
+                // Already logged, nothing else to do
+            }
+        }
+
         this.clearAuth();
         window.location.href = 'login.html';
     }
@@ -186,10 +195,21 @@ class GenieSugarAPI {
     // ==================== AI CHATBOT ====================
 
     async sendChatMessage(message) {
-        return await this.request('/ai/chat', {
+        let data = await this.request('/ai/chat', {
             method: 'POST',
             body: JSON.stringify({ message })
         });
+
+        // Reply is generated in the background; poll (up to ~60s) until it's ready
+        for (let polls = 0; data.pending; polls++) {
+            if (polls >= 60) {
+                throw new Error('AI reply timed out');
+            }
+            await new Promise(resolve => setTimeout(resolve, 1000));
+            data = await this.request(`/ai/chat/${data.task_id}`);
+        }
+
+        return data;
     }
 
     // ==================== REPORTS ====================
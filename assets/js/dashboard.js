@@ -356,7 +356,27 @@ async function sendMessage() {
             body: JSON.stringify({ message: message })
         });
 
-        const data = await response.json();
+        let data = await response.json();
+
+        // Reply is generated in the background; poll (up to ~60s) until it's ready
+        let polls = 0;
+        while (data.pending) {
+            if (++polls > 60) {
+                data = { success: false };
+                break;
+            }
+            await new Promise(resolve => setTimeout(resolve, 1000));
+            const poll = await fetch(`${API_URL}/ai/chat/${data.task_id}`, {
+                headers: {
+                    'Authorization': `Bearer ${token}`
+                }
+            });
+            if (!poll.ok) {
+                data = { success: false };
+                break;
+            }
+            data = await poll.json();
+        }
 
         // Remove typing indicator
         document.getElementById('typingIndicator')?.remove();
@@ -444,7 +464,22 @@ function showNotification(message, type = 'info') {
     }, 3000);
 }
 
-function logout() {
+async function logout() {
+    // Best-effort server-side revocation; always clear local state afterwards
+    const token = localStorage.getItem('token');
+    if (token) {
+        try {
+            await fetch(`${API_URL}/auth/logout`, {
+                method: 'POST',
+                headers: {
+                    'Authorization': `Bearer ${token}`
+                }
+            });
+        } catch (error) {
+            console.error('Logout error:', error);
+        }
+    }
+
     localStorage.removeItem('token');
     localStorage.removeItem('user');
     window.location.href = 'login.html';
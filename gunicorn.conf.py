@@ -0,0 +1,13 @@
+# gunicorn.conf.py - Production server settings (read automatically by `gunicorn app:app`)
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+
+# Threaded workers: pyodbc queries and Argon2 hashing block in C (releasing the
+# GIL), which suits real threads; under gevent they would stall every greenlet.
+# Keep workers x threads within the DB pool and Argon2 memory math next to
+# ENGINE_OPTIONS in app.py (threads beyond ARGON2_MAX_CONCURRENT wait to hash).
+worker_class = "gthread"
+workers = int(os.getenv("WEB_CONCURRENCY", "4"))
+threads = int(os.getenv("GUNICORN_THREADS", "8"))
+timeout = 120